@@ -20,6 +20,9 @@ def aggregate(config):
 
     Args:
         config: options from the json config file, else default values.
+
+    Returns:
+        length_to_combo_to_count: the sensitive aggregate counts as written to sensitive_aggregates_path.
     """
 
     use_columns = config['use_columns']
@@ -78,6 +81,7 @@ def aggregate(config):
         for combo, count in list(combo_to_count.items()):
             if util.protect(count, reporting_threshold, reporting_precision) == 0:
                 del combo_to_count[combo]
+    length_to_combo_to_count = {length: combo_to_count for length, combo_to_count in length_to_combo_to_count.items() if len(combo_to_count) > 0} # match what loadSavedAggregates reads back
 
     with open(reportable_aggregates_path, 'w') as ra:
         with open(sensitive_aggregates_path, 'w') as sa:
@@ -86,13 +90,18 @@ def aggregate(config):
             ra.write('\t'.join(['selections', 'protected_count'])+'\n')
             ra.write('\t'.join(['selections', str(util.protect(len(df), reporting_threshold, reporting_precision))])+'\n')
             for _, combo_to_count in length_to_combo_to_count.items():
+                sa_lines = []
+                ra_lines = []
                 for combo, count in combo_to_count.items():
                     selections_string = util.comboToString(combo)
                     protected_count = util.protect(count, reporting_threshold, reporting_precision)
-                    sa.write('\t'.join([str(selections_string), str(count)])+'\n')
+                    sa_lines.append(f'{selections_string}\t{count}\n')
                     if protected_count > 0:
-                        ra.write('\t'.join([str(selections_string), str(protected_count)])+'\n')
+                        ra_lines.append(f'{selections_string}\t{protected_count}\n')
+                sa.write(''.join(sa_lines))
+                ra.write(''.join(ra_lines))
 
 
     logging.info(f'Aggregated {sensitive_microdata_path} into {reportable_aggregates_path}, took {datetime.timedelta(seconds = time.time() - start_time)}s')
+    return length_to_combo_to_count
 
@@ -6,7 +6,7 @@ from collections import defaultdict
 import pandas as pd
 import util as util
 
-def evaluate(config):
+def evaluate(config, sensitive_counts=None, synthetic_df=None):
     """Evaluates the error in the synthetic microdata with respect to the sensitive microdata.
 
     Produces output statistics (tsv) and graphics (svg) for preservation_by_length and preservation_by_count,
@@ -14,6 +14,8 @@ def evaluate(config):
 
     Args:
         config: options from the json config file, else default values.
+        sensitive_counts: sensitive aggregate counts from an aggregate stage in the same run, else loaded from file.
+        synthetic_df: synthetic microdata from a generate stage in the same run, else loaded from file.
     """
 
     use_columns = config['use_columns']
@@ -31,8 +33,12 @@ def evaluate(config):
     logging.info(f'Evaluate {synthetic_microdata_path} vs {sensitive_microdata_path}')
     start_time = time.time()  
 
-    sen_counts = None
-    if not path.exists(config['sensitive_aggregates_path']):
+    sen_counts = sensitive_counts
+    if sen_counts is not None:
+        logging.info('Using sensitive aggregates from this run...')
+        if reporting_length == -1:
+            reporting_length = max(sen_counts.keys())
+    elif not path.exists(config['sensitive_aggregates_path']):
         logging.info('Computing sensitive aggregates...')
         sen_df = util.loadMicrodata(path=sensitive_microdata_path, delimiter=sensitive_microdata_delimiter, record_limit=record_limit, use_columns=use_columns)
         row_list = util.genRowList(sen_df, sensitive_zeros)
@@ -49,13 +55,15 @@ def evaluate(config):
         reporting_length = min(reporting_length, len(use_columns))
     
     filtered_sen_counts = {length: {combo: count for combo, count in combo_to_counts.items() if count >= reporting_threshold} for length, combo_to_counts in sen_counts.items()}
-    syn_df = util.loadMicrodata(path=synthetic_microdata_path, delimiter='\t', record_limit=-1, use_columns=use_columns)
+    syn_df = synthetic_df
+    if syn_df is None:
+        syn_df = util.loadMicrodata(path=synthetic_microdata_path, delimiter='\t', record_limit=-1, use_columns=use_columns)
     
     syn_counts = util.countAllCombos(util.genRowList(syn_df, sensitive_zeros), reporting_length, parallel_jobs)
 
     len_to_syn_count = {length: len(combo_to_count) for length, combo_to_count in syn_counts.items()}
     len_to_sen_rare = {length: {combo : count for combo, count in combo_to_count.items() if count < reporting_threshold} for length, combo_to_count in sen_counts.items()}
-    len_to_syn_leak = {length: len([1 for rare in rares if rare in syn_counts[length].keys()]) for length, rares in len_to_sen_rare.items()}
+    len_to_syn_leak = {length: len([1 for rare in rares if rare in syn_counts[length]]) for length, rares in len_to_sen_rare.items()}
 
     leakage_tsv = path.join(output_dir, f'{prefix}_synthetic_leakage_by_length.tsv')
     leakage_svg = path.join(output_dir, f'{prefix}_synthetic_leakage_by_length.svg')
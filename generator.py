@@ -19,6 +19,9 @@ def generate(config):
 
     Args:
         config: options from the json config file, else default values.
+
+    Returns:
+        sdf: the synthetic microdata as written to synthetic_microdata_path.
     """
 
     use_columns = config['use_columns']
@@ -92,6 +95,7 @@ def generate(config):
     sdf.to_csv(synthetic_microdata_path, sep = '\t', index=False)
 
     logging.info(f'Generated {synthetic_microdata_path} from {sensitive_microdata_path} with synthesis ratio {syn_ratio}, took {datetime.timedelta(seconds = time.time() - start_time)}s')
+    return sdf
 
 
 def synthesizeRowsSeeded(seeds, num_rows, columns, att_to_ids, threshold, memory_limit):
@@ -165,7 +169,7 @@ def synthesizeRowSeeded(seed, filters, disallowed, filter_cache, num_rows, colum
     row_cache_misses += cache_misses
     new_filters = filters
     while nxt != None:
-        new_filters = tuple(sorted((*new_filters, nxt), key=lambda x: f'{x[0]}:{x[1]}'.lower()))
+        new_filters = tuple(sorted((*new_filters, nxt), key=util.canonicalKey))
         nxt, cache_hits, cache_misses = sampleNextAttribute(seed, disallowed, filter_cache, columns, num_rows, new_filters, att_to_ids, threshold, memory_limit)
         row_cache_hits += cache_hits
         row_cache_misses += cache_misses
@@ -231,8 +235,8 @@ def synthesizeRowUnseeded(filter_cache, num_rows, columns, col_val_ids, threshol
     for col in shuffled_columns:
         vals_to_sample = {}
         for val, ids in col_val_ids[col].items():
-            next_filters = tuple(sorted((*output_atts, (col, val)), key=lambda x: f'{x[0]}:{x[1]}'.lower()))
-            if next_filters in filter_cache.keys():
+            next_filters = tuple(sorted((*output_atts, (col, val)), key=util.canonicalKey))
+            if next_filters in filter_cache:
                 vals_to_sample[val] = set(filter_cache[next_filters])
                 row_cache_hits += 1
             else:
@@ -255,7 +259,7 @@ def synthesizeRowUnseeded(filter_cache, num_rows, columns, col_val_ids, threshol
             residual_ids = set(vals_to_sample[sampled_val])
         
 
-    filters = tuple(sorted(output_atts, key=lambda x: f'{x[0]}:{x[1]}'.lower()))
+    filters = tuple(sorted(output_atts, key=util.canonicalKey))
     return filters, row_cache_hits, row_cache_misses
 
 
@@ -339,7 +343,7 @@ def residualAttributeCounts(seed, disallowed, filter_cache, columns, att_to_ids,
     cache_hits = 0
     cache_misses = 0
     use_cache = psutil.virtual_memory()[2] <= memory_limit # do not add to cache once memory limit is reached
-    if filters in filter_cache.keys():
+    if filters in filter_cache:
         residual_ids = filter_cache[filters] # use cached value if possible
         cache_hits += 1
     else:
@@ -354,16 +358,15 @@ def residualAttributeCounts(seed, disallowed, filter_cache, columns, att_to_ids,
             filter_cache[filters] = residual_ids # set cached value
 
     atts = sorted(att_to_ids.keys() if seed is None else seed, key = lambda x: len(att_to_ids[x]), reverse=False)
-    for att in disallowed:
-        if att in atts:
-            atts.remove(att)
+    atts = [att for att in atts if att not in disallowed]
+    filter_columns = set([x[0] for x in filters])
 
     for att in atts:
-        if att[0] in [x[0] for x in filters]:
+        if att[0] in filter_columns:
             continue
-        extended_filters = tuple(sorted((*filters, att), key=lambda x: f'{x[0]}:{x[1]}'.lower()))
+        extended_filters = tuple(sorted((*filters, att), key=util.canonicalKey))
         num = 0
-        if extended_filters in filter_cache.keys():
+        if extended_filters in filter_cache:
             num = len(filter_cache[extended_filters]) # use cached value if possible
             cache_hits += 1
         else:
@@ -447,7 +450,7 @@ def suppressToTargets(records, columns, att_to_ids, threshold, precision):
         new_record = None
         combo = util.rowToCombo(record, columns)
         for att in list(combo):
-            if att in targets.keys():
+            if att in targets:
                 combo.remove(att)
                 new_record = normalize(columns, combo)
                 if targets[att] == 1:
@@ -531,7 +534,7 @@ def consolidateRecord(available_atts, filter_cache, columns, att_to_ids, num_row
         filters: attributes of a new record synthesized from the available attributes.
     """
     filters = ()
-    disallowed = set([k for k in att_to_ids.keys() if k not in available_atts.keys() or (k in available_atts.keys() and available_atts[k] <= 0)])
+    disallowed = set([k for k in att_to_ids if k not in available_atts or available_atts[k] <= 0])
     
     if len(available_atts) > 0:
         residual_counts, _, _ = residualAttributeCounts(None, disallowed, filter_cache, columns, att_to_ids, num_rows, filters, threshold, memory_limit)
@@ -542,7 +545,7 @@ def consolidateRecord(available_atts, filter_cache, columns, att_to_ids, num_row
                 disallowed.add(next_att)
             else:
                 available_atts[next_att] -= 1
-            filters = tuple(sorted((*filters, next_att), key=lambda x: f'{x[0]}:{x[1]}'.lower()))
+            filters = tuple(sorted((*filters, next_att), key=util.canonicalKey))
             residual_counts, _, _ = residualAttributeCounts(None, disallowed, filter_cache, columns, att_to_ids, num_rows, filters, threshold, memory_limit)
             next_att = sampleFromCounts(residual_counts, preferNotNone=True)
         else:
@@ -1,6 +1,7 @@
 import time
 import datetime
 import json
+import hashlib
 import sys
 import logging
 import argparse
@@ -32,7 +33,8 @@ def main():
     logging.info('using config %s' %config_path)
     
     try:
-        config = json.load(open(config_path))
+        with open(config_path, 'r') as f:
+            config = json.load(f)
         config['aggregate'] = args.aggregate if args.aggregate != None else False
         config['generate'] = args.generate if args.generate != None else False
         config['evaluate'] = args.evaluate if args.evaluate != None else False
@@ -83,37 +85,153 @@ def main():
 def runPipeline(config):
     """Sets internal arguments from the config file and runs pipeline stages accordingly.
 
+    Aggregation is skipped if all its outputs exist and are stamped with the hash of its current inputs,
+    and evaluate/navigate only (re)run aggregate and generate if their outputs are missing or stale.
+    Outputs without a stamp (e.g., from an earlier version or supplied by the user) are reused as-is.
+    A stage's stamp is invalidated before it runs and only rewritten once it returns.
+    Each stage runs at most once per invocation, and evaluate reuses the in-memory results of
+    aggregate and generate from the same invocation instead of reloading them from file.
+
     Args:
         config: options from the json config file, else default values.
     """
-    
+    aggregate_outputs = [
+        config['sensitive_aggregates_path'],
+        config['reportable_aggregates_path'],
+        path.join(config['output_dir'], f'{config["prefix"]}_sensitive_rare_by_length.tsv'),
+        path.join(config['output_dir'], f'{config["prefix"]}_sensitive_rare_by_length.svg')]
+    generate_outputs = [config['synthetic_microdata_path']]
+    aggregate_keys = ['use_columns', 'record_limit', 'reporting_length', 'reporting_threshold',
+        'reporting_precision', 'sensitive_zeros', 'sensitive_microdata_path', 'sensitive_microdata_delimiter']
+    generate_keys = ['use_columns', 'record_limit', 'reporting_threshold', 'reporting_precision',
+        'sensitive_zeros', 'seeded', 'sensitive_microdata_path', 'sensitive_microdata_delimiter']
+    file_digests = {} # the sensitive microdata is hashed at most once, and only when a stamp is read or written
+    done = set()
+    sensitive_counts = None
+    synthetic_df = None
+
     if config['aggregate']:
-        aggregator.aggregate(config)
+        if outputStatus(aggregate_outputs, config, aggregate_keys, file_digests) == 'current':
+            logging.info(f'Sensitive aggregates are up to date; skipping aggregation')
+        else:
+            invalidateStamp(aggregate_outputs[0])
+            sensitive_counts = aggregator.aggregate(config)
+            writeStamp(aggregate_outputs[0], config, aggregate_keys, file_digests)
+        done.add('aggregate')
     
     if config['generate']:
-        generator.generate(config)
+        invalidateStamp(generate_outputs[0])
+        synthetic_df = generator.generate(config) # always resample when explicitly requested
+        writeStamp(generate_outputs[0], config, generate_keys, file_digests)
+        done.add('generate')
+
+    if config['evaluate'] or config['navigate']:
+        if 'aggregate' not in done:
+            status = outputStatus(aggregate_outputs, config, aggregate_keys, file_digests)
+            if status in ['missing', 'stale']:
+                logging.info(f'{status.capitalize()} sensitive aggregates; aggregating...')
+                invalidateStamp(aggregate_outputs[0])
+                sensitive_counts = aggregator.aggregate(config)
+                writeStamp(aggregate_outputs[0], config, aggregate_keys, file_digests)
+            elif status == 'unstamped':
+                logging.warning(f'No stamp for {aggregate_outputs[0]}; reusing existing sensitive aggregates')
+            done.add('aggregate')
+        if 'generate' not in done:
+            status = outputStatus(generate_outputs, config, generate_keys, file_digests)
+            if status in ['missing', 'stale']:
+                logging.info(f'{status.capitalize()} synthetic microdata; generating...')
+                invalidateStamp(generate_outputs[0])
+                synthetic_df = generator.generate(config)
+                writeStamp(generate_outputs[0], config, generate_keys, file_digests)
+            elif status == 'unstamped':
+                logging.warning(f'No stamp for {generate_outputs[0]}; reusing existing synthetic microdata')
+            done.add('generate')
 
     if config['evaluate']:
-        if not path.exists(config['sensitive_aggregates_path']):
-            logging.info(f'Missing sensitive aggregates; aggregating...')
-            aggregator.aggregate(config)
-        if not path.exists(config['synthetic_microdata_path']):
-            logging.info(f'Missing synthetic microdata; generating...')
-            generator.generate(config)
-        evaluator.evaluate(config)
+        evaluator.evaluate(config, sensitive_counts, synthetic_df)
 
     if config['navigate']:
-        if not path.exists(config['sensitive_aggregates_path']):
-            logging.info(f'Missing sensitive aggregates; aggregating...')
-            aggregator.aggregate(config)
-        if not path.exists(config['synthetic_microdata_path']):
-            logging.info(f'Missing synthetic microdata; generating...')
-            generator.generate(config)
-            
         navigator = Navigator(config)
         navigator.process()
 
-    json.dump(config, open(path.join(config['output_dir'], config['prefix'] + '_config.json'), 'w'), indent=1)
+    with open(path.join(config['output_dir'], config['prefix'] + '_config.json'), 'w') as f:
+        json.dump(config, f, indent=1)
+
+
+def hashInputs(config, input_keys, file_digests):
+    """Hashes the config options and sensitive microdata that a stage's outputs depend on.
+
+    Args:
+        config: options from the json config file, else default values.
+        input_keys: the config options the stage depends on.
+        file_digests: dict caching file digests by path, so that each file is read at most once per run.
+
+    Returns:
+        inputs_hash: hex digest of the inputs.
+    """
+    microdata_path = config['sensitive_microdata_path']
+    if microdata_path not in file_digests:
+        f_hash = hashlib.blake2b(digest_size=16)
+        if microdata_path is not None and path.exists(microdata_path):
+            with open(microdata_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    f_hash.update(block)
+        file_digests[microdata_path] = f_hash.digest()
+    h = hashlib.blake2b(json.dumps({k: config[k] for k in input_keys}, sort_keys=True).encode(), digest_size=16)
+    h.update(file_digests[microdata_path])
+    return h.hexdigest()
+
+
+def outputStatus(output_paths, config, input_keys, file_digests):
+    """Checks whether a stage's outputs exist and were produced from its current inputs.
+
+    The stamp is kept next to the first output path. The inputs are only hashed if there is a stamp to compare against.
+
+    Args:
+        output_paths: the paths of all outputs of the stage.
+        config: options from the json config file, else default values.
+        input_keys: the config options the stage depends on.
+        file_digests: dict caching file digests by path (see hashInputs).
+
+    Returns:
+        status: 'missing' if any output is missing, 'unstamped' if the outputs have no stamp,
+            'stale' if the stamp does not match the hash of the current inputs, else 'current'.
+    """
+    if not all([path.exists(output_path) for output_path in output_paths]):
+        return 'missing'
+    stamp_path = output_paths[0] + '.stamp'
+    if not path.exists(stamp_path):
+        return 'unstamped'
+    with open(stamp_path, 'r') as f:
+        stamp = f.read().strip()
+    return 'current' if stamp == hashInputs(config, input_keys, file_digests) else 'stale'
+
+
+def invalidateStamp(output_path):
+    """Marks an output as being rewritten, so that it counts as stale until writeStamp records its new inputs.
+
+    Outputs left half-written by an interrupted stage then get rebuilt rather than matched by their old stamp.
+
+    Args:
+        output_path: the output file path.
+    """
+    with open(output_path + '.stamp', 'w') as f:
+        f.write('')
+
+
+def writeStamp(output_path, config, input_keys, file_digests):
+    """Records the hash of the inputs an output was produced from.
+
+    Args:
+        output_path: the output file path.
+        config: options from the json config file, else default values.
+        input_keys: the config options the stage depends on.
+        file_digests: dict caching file digests by path (see hashInputs).
+    """
+    inputs_hash = hashInputs(config, input_keys, file_digests)
+    with open(output_path + '.stamp', 'w') as f:
+        f.write(inputs_hash)
+
 
 if __name__ == '__main__':
     main( )
@@ -96,7 +96,8 @@ def main():
 
     }
 
-    json.dump(config, open(path.join('.', config['prefix'] + '_config.json'), 'w'), indent=1)
+    with open(path.join('.', config['prefix'] + '_config.json'), 'w') as f:
+        json.dump(config, f, indent=1)
 
     config['aggregate'] = True
     config['generate'] = True
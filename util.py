@@ -5,8 +5,10 @@ import pandas as pd
 from os import path
 import joblib
 import re
+import csv
+from functools import lru_cache
 from itertools import combinations
-from collections import defaultdict
+from collections import defaultdict, Counter
 import seaborn as sns
 from math import ceil
 import matplotlib
@@ -14,7 +16,7 @@ matplotlib.use('Agg') # fixes matplotlib + joblib bug "RuntimeError: main thread
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 
-def loadMicrodata(path, delimiter, record_limit, use_columns):
+def loadMicrodata(path, delimiter, record_limit, use_columns, chunk_size=100000):
     """Loads delimited microdata with column headers into a pandas dataframe.
 
     Args:
@@ -22,16 +24,21 @@ def loadMicrodata(path, delimiter, record_limit, use_columns):
         delimiter: the delimiter used to delimit data columns.
         record_limit: how many rows to load (-1 loads all rows).
         use_columns: which columns to load.
+        chunk_size: how many rows to parse and clean at a time.
     """
-    df = pd.read_csv(path, delimiter).astype(str) \
-        .replace(to_replace=r'^nan$', value='', regex=True) \
-        .replace(to_replace=r'\.0$', value='', regex=True) \
-        .replace(to_replace=';', value='.,', regex=False) \
-        .replace(to_replace=':', value='..', regex=False)  # fix pandas type coercion for numbers and remove reserved delimiters
+    chunks = []
+    reader = pd.read_csv(path, delimiter=delimiter, usecols=use_columns if use_columns != [] else None, dtype=str,
+        nrows=record_limit if record_limit > 0 else None, chunksize=chunk_size)
+    reserved = str.maketrans({';': '.,', ':': '..'}) # remove reserved delimiters
+    for chunk in reader:
+        for c in chunk.columns:
+            vals = chunk[c].fillna('')
+            vals = vals.where(~vals.str.endswith('.0'), vals.str[:-2])
+            chunk[c] = vals.str.translate(reserved)
+        chunks.append(chunk)
+    df = pd.concat(chunks, ignore_index=True)
     if use_columns != []:
         df = df[use_columns]
-    if record_limit > 0:
-        df = df[:record_limit]
     return df
 
 
@@ -45,15 +52,33 @@ def genRowList(df, sensitive_zeros):
     Returns:
         row_list: the list of rows.
     """
-    row_list = []
-    for _, row in df.iterrows():
-        res = []
-        for c in df.columns:
-            val = str(row[c])
-            if val != '' and (c in sensitive_zeros or val != '0'):
-                res.append((c, val))
-        row2 = sorted(res, key=lambda x: f'{x[0]}:{x[1]}'.lower())
-        row_list.append(row2)
+    if len(df) == 0:
+        return []
+    cols = df.columns.to_numpy()
+    col_keys = [f'{c}:'.lower() for c in cols]
+    order = sorted(range(len(cols)), key=lambda i: col_keys[i]) # sort columns once so rows emerge in canonical order
+    # that only holds if no column key is a prefix of another (e.g., columns 'a' and 'A'), else sort each row by its values too
+    sort_rows = any([col_keys[j].startswith(col_keys[i]) for i, j in zip(order, order[1:])])
+    if sort_rows:
+        order = list(range(len(cols)))
+    cols = cols[order]
+    values = df.astype(str).to_numpy(dtype=object)[:, order]
+    keep = values != ''
+    zero_cols = ~np.isin(cols, sensitive_zeros)
+    keep[:, zero_cols] &= values[:, zero_cols] != '0'
+    atts = np.empty(values.shape, dtype=object)
+    for i, c in enumerate(cols):
+        codes, uniques = pd.factorize(values[:, i])
+        col_atts = np.empty(len(uniques), dtype=object)
+        for j, val in enumerate(uniques):
+            col_atts[j] = (c, val)
+        atts[:, i] = col_atts[codes] # share one tuple per distinct attribute, so equal keys also compare by identity
+    row_ids, col_ids = np.nonzero(keep)
+    flat_atts = atts[row_ids, col_ids].tolist()
+    ends = np.cumsum(keep.sum(axis=1)).tolist()
+    row_list = [flat_atts[start:end] for start, end in zip([0] + ends[:-1], ends)]
+    if sort_rows:
+        row_list = [sorted(row, key=canonicalKey) for row in row_list]
     return row_list
 
 def computeAttToIds(row_list):
@@ -80,23 +105,34 @@ def genColValIdsDict(df, sensitive_zeros):
     Returns:
         colValIds: the dict of col->val->ids.
     """
+    index = df.index.to_numpy()
+    sensitive_zeros = set(sensitive_zeros)
     colValIds = {}
-    for rid, row in df.iterrows():
-        for c in df.columns:
-            val = str(row[c])
-            if c not in colValIds.keys():
-                colValIds[c] = defaultdict(list)
-            if val == '0':
-                if c in sensitive_zeros:
-                    colValIds[c][val].append(rid)
-                else:
-                    colValIds[c][''].append(rid)
-            else:
-                colValIds[c][val].append(rid)
+    for c in df.columns:
+        col_vals = df[c].astype(str)
+        if c not in sensitive_zeros:
+            col_vals = col_vals.where(col_vals != '0', '')
+        colValIds[c] = defaultdict(list)
+        val_to_positions = col_vals.groupby(col_vals, sort=False).indices
+        for val, positions in sorted(val_to_positions.items(), key=lambda x: x[1][0]): # preserve order of first appearance
+            colValIds[c][val] = index[positions].tolist()
 
     return colValIds
 
 
+@lru_cache(maxsize=None)
+def canonicalKey(att):
+    """Creates the canonical sort key of an (attribute, value) tuple, cached since the same attributes recur across rows.
+
+    Args:
+        att: the (attribute, value) tuple.
+
+    Returns:
+        key: the lowercased 'attribute:value' string.
+    """
+    return f'{att[0]}:{att[1]}'.lower()
+
+
 def rowToCombo(row, columns):
     """Converts a row to a list of (Attribute, Value) tuples.
 
@@ -112,15 +148,17 @@ def rowToCombo(row, columns):
         val = str(row[i])
         if val != '':
             res.append((c, val))
-    combo = sorted(res, key=lambda x: f'{x[0]}:{x[1]}'.lower())
+    combo = sorted(res, key=canonicalKey)
     return combo
 
 
 def countAllCombos(row_list, length_limit, parallel_jobs):
     """Counts all combinations in the given rows up to a limit.
 
+    Combinations keep the order of attributes in their row, so rows must already be in canonical order (see genRowList).
+
     Args:
-        row_list: a list of rows.
+        row_list: a list of rows, each sorted by canonicalKey.
         length_limit: the maximum length to compute counts for (all lengths if -1).
         parallel_jobs: the number of processor cores to use for parallelized counting.
 
@@ -130,36 +168,129 @@ def countAllCombos(row_list, length_limit, parallel_jobs):
     length_to_combo_to_count = {}
     if length_limit == -1:
         length_limit = max([len(x) for x in row_list])
+    atts, ids, offsets = encodeRows(row_list)
+    att_array = np.empty(len(atts), dtype=object)
+    for i, att in enumerate(atts):
+        att_array[i] = att
+    chunk = max(1, ceil(len(row_list)/(parallel_jobs*4))) # a few large tasks per worker amortize dispatch overhead
+    bounds = [(start, min(start + chunk, len(row_list))) for start in range(0, len(row_list), chunk)]
     for length in range(1, length_limit+1):
         logging.info(f'counting combos of length {length}')
-        res = joblib.Parallel(n_jobs=parallel_jobs, backend='loky', verbose=1) (joblib.delayed(genAllCombos)(row, length) for row in row_list)
-        length_to_combo_to_count[length] = defaultdict(int)
-        for combos in res:
-            for combo in combos:
-                length_to_combo_to_count[length][combo] += 1
+        # ids/offsets are plain numpy buffers, so joblib memory-maps them to the workers instead of pickling row lists per task
+        res = joblib.Parallel(n_jobs=parallel_jobs, backend='loky', batch_size='auto', verbose=1) (joblib.delayed(countEncodedCombos)(ids, offsets, len(atts), length, start, stop) for start, stop in bounds)
+        combos, counts = countUniqueCombos(
+            np.concatenate([np.zeros((0, length), dtype=np.int64)] + [combos for combos, _ in res]),
+            len(atts),
+            np.concatenate([np.zeros(0, dtype=np.int64)] + [counts for _, counts in res]))
+        length_to_combo_to_count[length] = Counter(dict(zip(map(tuple, att_array[combos].tolist()), counts.tolist())))
     
     return length_to_combo_to_count
 
 
-def genAllCombos(row, length):
-    """Generates all combos from row up to and including size length.
+def encodeRows(row_list):
+    """Integer-encodes the attributes of row_list into a flat array of ids.
 
     Args:
-        row: the row to extract combinations from.
-        length: the maximum combination length to extract.
+        row_list: a list of rows.
 
     Returns:
-        combos: list of combinations extracted from row.
+        atts: a list mapping each id to its (attribute, value) tuple.
+        ids: the concatenated attribute ids of all rows (in row order).
+        offsets: the start position of each row in ids, followed by the total length.
     """
-    res = []
-    if len(row) == length:
-        canonical_combo = tuple(sorted(list(row), key=lambda x: f'{x[0]}:{x[1]}'.lower()))
-        res.append(canonical_combo)
+    att_to_id = {}
+    ids = np.fromiter((att_to_id.setdefault(att, len(att_to_id)) for row in row_list for att in row), dtype=np.int32)
+    offsets = np.zeros(len(row_list)+1, dtype=np.int64)
+    np.cumsum([len(row) for row in row_list], out=offsets[1:])
+    atts = list(att_to_id.keys())
+    return atts, ids, offsets
+
+
+def countEncodedCombos(ids, offsets, num_atts, length, start, stop, batch_size=1<<21):
+    """Counts all combos of a given length in the encoded rows start to stop.
+
+    Rows with the same number of attributes are stacked into a 2d array so that all their combos can be gathered at once.
+    Since rows are in canonical order (as produced by genRowList), so are combos taken in position order.
+
+    Args:
+        ids: the concatenated attribute ids of all rows.
+        offsets: the start position of each row in ids, followed by the total length.
+        num_atts: the number of distinct attribute ids.
+        length: the combination length to count.
+        start: the first row to count.
+        stop: the row after the last row to count.
+        batch_size: the maximum number of combos to gather at once.
+
+    Returns:
+        combos: 2d array of the distinct combos of attribute ids, one per row.
+        counts: the count of each combo.
+    """
+    row_starts = offsets[start:stop]
+    row_lengths = np.diff(offsets[start:stop+1])
+    all_combos = [np.zeros((0, length), dtype=np.int64)]
+    all_counts = [np.zeros(0, dtype=np.int64)]
+    for row_length in np.unique(row_lengths[row_lengths >= length]):
+        same_length_starts = row_starts[row_lengths == row_length]
+        positions = np.array(list(combinations(range(row_length), length)))
+        rows_per_batch = max(1, batch_size // len(positions))
+        for b in range(0, len(same_length_starts), rows_per_batch):
+            rows = ids[same_length_starts[b:b+rows_per_batch, None] + np.arange(row_length)]
+            combos, counts = countUniqueCombos(rows[:, positions].reshape(-1, length), num_atts)
+            all_combos.append(combos)
+            all_counts.append(counts)
+    return countUniqueCombos(np.concatenate(all_combos), num_atts, np.concatenate(all_counts))
+
+
+def packCombos(combos, num_atts):
+    """Packs each combo of attribute ids into a single int64 key, which sorts and compares much faster than rows.
+
+    Args:
+        combos: 2d array of combos of attribute ids, one per row.
+        num_atts: the number of distinct attribute ids.
+
+    Returns:
+        keys: the packed key of each combo, or None if keys of this length could overflow int64.
+    """
+    length = combos.shape[1]
+    if num_atts ** length >= 2 ** 63:
+        return None
+    return combos.astype(np.int64) @ (num_atts ** np.arange(length-1, -1, -1, dtype=np.int64))
+
+
+def unpackCombos(keys, num_atts, length):
+    """Unpacks int64 keys created by packCombos.
+
+    Args:
+        keys: the packed key of each combo.
+        num_atts: the number of distinct attribute ids.
+        length: the combination length.
+
+    Returns:
+        combos: 2d array of combos of attribute ids, one per row.
+    """
+    return (keys[:, None] // (num_atts ** np.arange(length-1, -1, -1, dtype=np.int64))) % num_atts
+
+
+def countUniqueCombos(combos, num_atts, counts=None):
+    """Counts the distinct combos in a 2d array of attribute ids.
+
+    Args:
+        combos: 2d array of combos of attribute ids, one per row.
+        num_atts: the number of distinct attribute ids.
+        counts: the count of each row of combos (1 if None).
+
+    Returns:
+        unique_combos: 2d array of the distinct combos, one per row.
+        unique_counts: the total count of each distinct combo.
+    """
+    keys = packCombos(combos, num_atts)
+    if keys is not None:
+        keys, inverse = np.unique(keys, return_inverse=True)
+        unique_combos = unpackCombos(keys, num_atts, combos.shape[1])
     else:
-        for combo in combinations(row, length):
-            canonical_combo = tuple(sorted(list(combo), key=lambda x: f'{x[0]}:{x[1]}'.lower()))
-            res.append(canonical_combo)
-    return res
+        unique_combos, inverse = np.unique(combos, axis=0, return_inverse=True)
+    unique_counts = np.bincount(inverse.reshape(-1), weights=counts, minlength=len(unique_combos)).astype(np.int64)
+    return unique_combos, unique_counts
 
 
 def protect(value, threshold, precision):
@@ -186,10 +317,7 @@ def comboToString(combo_tuple):
     Returns:
         combo_string: a ;-delimited string of ':'-concatenated attribute-value pairs.
     """
-    combo_string = ''
-    for (col, val) in combo_tuple:
-        combo_string += f'{col}:{val};'
-    return combo_string[:-1]
+    return ';'.join([f'{col}:{val}' for (col, val) in combo_tuple])
 
 
 def loadSavedAggregates(path):
@@ -202,34 +330,50 @@ def loadSavedAggregates(path):
         length_to_combo_to_count: a dict mapping combination lengths to dicts mapping combinations to counts
     """
     length_to_combo_to_count = defaultdict(dict)
-    with open(path, 'r') as f:
-        for i, line in enumerate(f):
-            if i == 0:
-                continue # skip header
-            parts = [x.strip() for x in line.split('\t')]
-            if len(parts[0]) > 0:
-                length, combo = stringToLengthAndCombo(parts[0])
-                length_to_combo_to_count[length][combo] = int(parts[1])
+    df = pd.read_csv(path, sep='\t', usecols=[0, 1], dtype={0: str, 1: np.int64}, na_filter=False, quoting=csv.QUOTE_NONE) # C parser splits fields and converts counts
+    att_cache = {}
+    for selections, count in zip(df.iloc[:, 0].tolist(), df.iloc[:, 1].tolist()):
+        selections = selections.strip()
+        if len(selections) > 0:
+            length, combo = stringToLengthAndCombo(selections, att_cache)
+            length_to_combo_to_count[length][combo] = count
     return length_to_combo_to_count
 
 
-def stringToLengthAndCombo(combo_string):
+def stringToLengthAndCombo(combo_string, att_cache=None):
     """Creates a tuple of (attribute, value) tuples from a given string.
 
     Args:
         combo_string: string representation of (attribute, value) tuples.
+        att_cache: optional dict caching parsed (attribute, value) tuples by their string, shared across calls.
 
     Returns:
+        length: the number of attributes in the string.
         combo_tuple: tuple of (attribute, value) tuples.
     """
-    length = len(combo_string.split(';'))
+    if att_cache is None:
+        att_cache = {}
+    col_vals = combo_string.split(';')
     combo_list = []
-    for col_vals in combo_string.split(';'):
-        parts = col_vals.split(':')
-        if len(parts) == 2:
-            combo_list.append((parts[0],parts[1]))
+    for col_val in col_vals:
+        att = att_cache.get(col_val)
+        if att is None:
+            parts = col_val.split(':')
+            att = att_cache[col_val] = (parts[0], parts[1]) if len(parts) == 2 else ()
+        if att:
+            combo_list.append(att)
     combo_tuple = tuple(combo_list)
-    return length, combo_tuple
+    return len(col_vals), combo_tuple
+
+
+def formatCountTick(x, pos):
+    """Formats a count axis tick with thousands separators."""
+    return '{:,.0f}'.format(x)
+
+
+def formatProportionTick(x, pos):
+    """Formats a proportion axis tick to two decimal places."""
+    return '{:,.2f}'.format(x)
 
 
 def plotStats(x_axis, x_axis_title, y_bar, y_bar_title, y_line, y_line_title, color, darker_color, stats_tsv, stats_svg, delimiter, style='whitegrid', palette='magma'):
@@ -252,7 +396,7 @@ def plotStats(x_axis, x_axis_title, y_bar, y_bar_title, y_line, y_line_title, co
     fig, ax1 = plt.subplots(figsize=(12,4.5))
     cnt_color = color
     font_size = 12
-    ax1 = sns.barplot(x=x_axis, y=y_bar, data=df, color=cnt_color, order=df[x_axis].values)
+    ax1 = sns.barplot(x=x_axis, y=y_bar, data=df, color=cnt_color, order=df[x_axis].values, ax=ax1)
     y_ticks = list(ax1.get_yticks())
     y_max = ceil(df[y_bar].max())
     y_upper = y_ticks[-1]
@@ -268,24 +412,18 @@ def plotStats(x_axis, x_axis_title, y_bar, y_bar_title, y_line, y_line_title, co
     ax1.set_xlabel(x_axis_title, fontsize=font_size)
     ax1.set_ylabel(y_bar_title, fontsize=font_size)
     ax1.set_yticklabels(new_y_ticks, fontsize=font_size)
-    ax1.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, pos: '{:,.0f}'.format(x)))
+    ax1.yaxis.set_major_formatter(ticker.FuncFormatter(formatCountTick))
     ax2 = ax1.twinx()
     pct_color = darker_color
-    ax2 = sns.pointplot(x=x_axis, y=y_line, data=df, color=pct_color, order=df[x_axis].values)
+    ax2 = sns.pointplot(x=x_axis, y=y_line, data=df, color=pct_color, order=df[x_axis].values, ax=ax2)
     ax2.set_ylabel(y_line_title, fontsize=font_size, color=pct_color)
     ax2.set_yticklabels(ax2.get_yticks(), fontsize=font_size)
     ax2.set_xticklabels(ax2.get_xmajorticklabels(), fontsize=font_size)
     ax2.set_ylim([-0.1, max(1.0, df[y_line].max()) + 0.1])
-    ax2.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, pos: '{:,.2f}'.format(x)))
-    x = list(range(0, len(df[x_axis].values)))
-    y = df[y_line]
-    for i in range(len(df)):
-        label = f'{y.loc[i]:.2f}'
-        ax2.annotate(label, xy=(x[i], y.loc[i]), fontsize=font_size,
-            xytext = (0,0), textcoords="offset points",
-            bbox=dict(pad=0.9, alpha=1, fc=pct_color, color='none'),
-            va='center', ha='center', color='white')
-    plt.tight_layout()
+    ax2.yaxis.set_major_formatter(ticker.FuncFormatter(formatProportionTick))
+    label_bbox = dict(pad=0.9, alpha=1, fc=pct_color, color='none')
+    for x, y in enumerate(df[y_line].tolist()):
+        ax2.text(x, y, f'{y:.2f}', fontsize=font_size, bbox=label_bbox, va='center', ha='center', color='white')
+    fig.tight_layout()
     fig.savefig(stats_svg)
-    plt.figure().clear()
-    plt.close()
\ No newline at end of file
+    plt.close(fig)
\ No newline at end of file